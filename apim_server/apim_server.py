@@ -1,14 +1,15 @@
 import asyncio
+import json
 import uuid
 import time
 from contextlib import asynccontextmanager
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import logging
 from datetime import datetime, timezone
 
 import aiohttp
 from fastapi import FastAPI, Request, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 import redis.asyncio as redis
 
 import config
@@ -28,87 +29,178 @@ def count_output_tokens(response_json: dict) -> int:
         return sum(len(c.get("message", {}).get("content", "")) for c in response_json.get("choices", []))
     except Exception: return 0
 
-REQUEST_QUEUE = asyncio.Queue()
+# --- Passthrough 모드: 원본 바이트는 그대로 전달하고, 토큰 집계용으로만 json.loads(재직렬화 없음) ---
+# 순수 Python 스캐너는 메시지가 많거나 escape가 많은 큰 본문에서 C 구현인 json.loads보다 느려 크기와 관계없이 파싱합니다.
+
+# 업스트림 응답 헤더 중 그대로 전달하면 안 되는 항목 (길이/인코딩은 다시 계산되고, date/server는 uvicorn이 붙임)
+_PASSTHROUGH_EXCLUDED_HEADERS = frozenset({
+    "connection", "keep-alive", "transfer-encoding", "content-length", "content-encoding", "date", "server",
+})
+
+def _parse_and_count(body: bytes, counter) -> int:
+    try:
+        return counter(json.loads(body))
+    except Exception: return 0
+
+def count_body_input_tokens(body: bytes) -> int:
+    return _parse_and_count(body, count_input_tokens)
+
+def count_body_output_tokens(body: bytes) -> int:
+    return _parse_and_count(body, count_output_tokens)
+
+def passthrough_headers(headers) -> Dict[str, str]:
+    return {k: v for k, v in headers.items() if k.lower() not in _PASSTHROUGH_EXCLUDED_HEADERS}
+
+class RequestQueue(asyncio.Queue):
+    def peek_nowait(self):
+        """맨 앞 요청을 꺼내지 않고 반환합니다. (micro-batching이 FIFO 순서를 유지하며 배치 가능 여부를 확인하는 데 사용)"""
+        if self.empty(): raise asyncio.QueueEmpty
+        return self._queue[0]
+
+REQUEST_QUEUE = RequestQueue()
 RESULTS_STORE: Dict[str, Any] = {}
 COMPLETION_EVENTS: Dict[str, asyncio.Event] = {}
+# 요청별 소요 시간 (응답 헤더로 노출되어 부하 테스트에서 queue-wait / upstream 구간을 분리하는 데 사용)
+REQUEST_TIMINGS: Dict[str, Dict[str, str]] = {}
+QUEUE_WAIT_HEADER = "X-APIM-Queue-Wait-Ms"
+UPSTREAM_TIME_HEADER = "X-APIM-Upstream-Ms"
 
-async def background_worker(redis_client: redis.Redis, llm_redis_client: redis.Redis):
-    lua_schedule = """
-        -- KEYS[1]: rpm_capacity_key, KEYS[2]: tpm_capacity_key, KEYS[3]: apim_rpm_window
-        -- ARGV[1]: rpm_max_capacity, ARGV[2]: rpm_rate_per_sec, ARGV[3]: rpm_needed
-        -- ARGV[4]: tpm_max_capacity, ARGV[5]: tpm_rate_per_sec, ARGV[6]: tpm_needed
-        -- ARGV[7]: now, ARGV[8]: one_minute_ago, ARGV[9]: rpm_limit, ARGV[10]: unique_id
-
-        local function refill(key, max_cap, rate, now)
-            local data = redis.call('HMGET', key, 'available', 'last_ts')
-            local available, last_ts = tonumber(data[1]), tonumber(data[2])
-            if not available or not last_ts then available, last_ts = max_cap, now end
-            local elapsed = now - last_ts
-            if elapsed > 0 then
-                available = math.min(max_cap, available + elapsed * rate)
-            end
-            return available, last_ts
+# --- Micro-batching: 작은 non-streaming 요청 여러 개를 배치 엔드포인트 호출 1회로 묶음 ---
+# 배치 응답은 요청별로 분리·재직렬화해야 하므로 MICRO_BATCH_ENABLED이면 passthrough가 꺼지고 JSON 경로로 처리됩니다.
+def request_input_tokens(payload) -> int:
+    return count_body_input_tokens(payload) if isinstance(payload, bytes) else count_input_tokens(payload)
+
+def is_batchable(payload, input_tokens: int) -> bool:
+    if not isinstance(payload, dict) or input_tokens > config.MICRO_BATCH_MAX_INPUT_TOKENS: return False
+    return not payload.get("stream", False)
+
+async def collect_batch(first: tuple) -> list:
+    """
+    큐 맨 앞의 batchable 요청을 최대 MICRO_BATCH_MAX_SIZE개까지 모읍니다.
+    MICRO_BATCH_MAX_LINGER_SECONDS 동안만 새 요청을 기다리며, 맨 앞 요청이 배치에 넣을 수 없는 요청이면
+    꺼내지 않고 그 자리에서 멈춰 FIFO 순서를 유지합니다. (다음 루프에서 단건으로 처리됨)
+    """
+    batch = [first]
+    deadline = time.monotonic() + config.MICRO_BATCH_MAX_LINGER_SECONDS
+    while len(batch) < config.MICRO_BATCH_MAX_SIZE:
+        if REQUEST_QUEUE.empty():
+            if time.monotonic() >= deadline: break
+            await asyncio.sleep(SCHEDULER_LOOP_SLEEP_SECONDS)
+            continue
+        head = REQUEST_QUEUE.peek_nowait()
+        tokens = request_input_tokens(head[1])
+        if not is_batchable(head[1], tokens): break
+        batch.append((REQUEST_QUEUE.get_nowait(), tokens))
+    return batch
+
+def build_batch_payload(payloads: list) -> Dict[str, Any]:
+    return {"requests": payloads}
+
+def split_batch_response(response_json: Dict[str, Any], size: int):
+    """배치 응답을 요청 순서대로 (payload, status, headers) 목록과 전체 출력 토큰 수로 분리합니다."""
+    responses = response_json.get("responses", [])
+    if len(responses) != size:
+        raise ValueError(f"Batch response has {len(responses)} items, expected {size}.")
+    results = []
+    for item in responses:
+        if "choices" in item:
+            results.append((item, 200, None))
+        else:
+            # 항목별 오류(예: 검증 실패 422)는 해당 요청에만 단건 호출과 같은 형식으로 전달
+            results.append(({"detail": item.get("detail")}, item.get("status_code", 502), None))
+    return results, sum(count_output_tokens(item) for item in responses if "choices" in item)
+
+# 원자적 스케줄링 스크립트 (benchmarks/simulator.py가 같은 로직을 Python으로 재현하고 차등 테스트에 사용)
+# 주의: Redis는 Lua number를 정수 reply로 변환하므로 WAIT_TOKENS의 대기 시간은 소수점 이하가 버려진 값으로 반환됩니다.
+LUA_SCHEDULE = """
+    -- KEYS[1]: rpm_capacity_key, KEYS[2]: tpm_capacity_key, KEYS[3]: apim_rpm_window
+    -- ARGV[1]: rpm_max_capacity, ARGV[2]: rpm_rate_per_sec, ARGV[3]: rpm_needed
+    -- ARGV[4]: tpm_max_capacity, ARGV[5]: tpm_rate_per_sec, ARGV[6]: tpm_needed
+    -- ARGV[7]: now, ARGV[8]: one_minute_ago, ARGV[9]: rpm_limit, ARGV[10]: unique_id
+    -- ARGV[11]: enforce_strict_rpm (1/0)
+
+    local function refill(key, max_cap, rate, now)
+        local data = redis.call('HMGET', key, 'available', 'last_ts')
+        local available, last_ts = tonumber(data[1]), tonumber(data[2])
+        if not available or not last_ts then available, last_ts = max_cap, now end
+        local elapsed = now - last_ts
+        if elapsed > 0 then
+            available = math.min(max_cap, available + elapsed * rate)
         end
+        return available, last_ts
+    end
 
-        local now = tonumber(ARGV[7])
-        local one_minute_ago = tonumber(ARGV[8])
-        local rpm_limit = tonumber(ARGV[9])
+    local now = tonumber(ARGV[7])
+    local one_minute_ago = tonumber(ARGV[8])
+    local rpm_limit = tonumber(ARGV[9])
 
-        -- 1) Clean old window entries and check current RPM count atomically
-        redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', one_minute_ago)
+    -- 1) Clean old window entries and check current RPM count atomically
+    redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', one_minute_ago)
+    if ARGV[11] == '1' then
         local current_rpm = redis.call('ZCARD', KEYS[3])
         if current_rpm >= rpm_limit then
             return {'WAIT_RPM'}
         end
+    end
 
-        -- 2) Refill token buckets and check capacity
-        local rpm_available = refill(KEYS[1], tonumber(ARGV[1]), tonumber(ARGV[2]), now)
-        local tpm_available = refill(KEYS[2], tonumber(ARGV[4]), tonumber(ARGV[5]), now)
+    -- 2) Refill token buckets and check capacity
+    local rpm_available = refill(KEYS[1], tonumber(ARGV[1]), tonumber(ARGV[2]), now)
+    local tpm_available = refill(KEYS[2], tonumber(ARGV[4]), tonumber(ARGV[5]), now)
 
-        local rpm_needed = tonumber(ARGV[3])
-        local tpm_needed = tonumber(ARGV[6])
+    local rpm_needed = tonumber(ARGV[3])
+    local tpm_needed = tonumber(ARGV[6])
 
-        if rpm_available < rpm_needed then
-            local wait = (rpm_needed - rpm_available) / tonumber(ARGV[2])
-            return {'WAIT_TOKENS', wait}
-        end
-        if tpm_available < tpm_needed then
-            local wait = (tpm_needed - tpm_available) / tonumber(ARGV[5])
-            return {'WAIT_TOKENS', wait}
-        end
+    if rpm_available < rpm_needed then
+        local wait = (rpm_needed - rpm_available) / tonumber(ARGV[2])
+        return {'WAIT_TOKENS', wait}
+    end
+    if tpm_available < tpm_needed then
+        local wait = (tpm_needed - tpm_available) / tonumber(ARGV[5])
+        return {'WAIT_TOKENS', wait}
+    end
 
-        -- 3) Consume and record atomically
-        redis.call('HMSET', KEYS[1], 'available', rpm_available - rpm_needed, 'last_ts', now)
-        redis.call('HMSET', KEYS[2], 'available', tpm_available - tpm_needed, 'last_ts', now)
-        redis.call('ZADD', KEYS[3], now, ARGV[10])
-        redis.call('EXPIRE', KEYS[3], 120)
-        return {'OK'}
-    """
-    
+    -- 3) Consume and record atomically
+    redis.call('HMSET', KEYS[1], 'available', rpm_available - rpm_needed, 'last_ts', now)
+    redis.call('HMSET', KEYS[2], 'available', tpm_available - tpm_needed, 'last_ts', now)
+    redis.call('ZADD', KEYS[3], now, ARGV[10])
+    redis.call('EXPIRE', KEYS[3], 120)
+    return {'OK'}
+"""
+
+def admission_script_args(now: float, input_tokens: int, unique_id: str, prefix: Optional[str] = None) -> list:
+    """LUA_SCHEDULE 호출 인자(numkeys, KEYS, ARGV 순서)를 현재 config 값으로 만듭니다."""
+    prefix = prefix or config.APIM_USAGE_PREFIX
+    # --- BURST_FACTOR 반영: 초기 버킷 용량을 제한해 초기 스파이크 제어 ---
+    rpm_capacity = float(config.RPM_LIMIT) * float(getattr(config, 'BURST_FACTOR', 1.0))
+    tpm_capacity = float(config.TPM_LIMIT) * float(getattr(config, 'BURST_FACTOR', 1.0))
+    strict_rpm = 1 if getattr(config, 'ENFORCE_STRICT_RPM', True) else 0
+    return [
+        3,
+        f"{prefix}:rpm_capacity", f"{prefix}:tpm_capacity", f"{prefix}:rpm_window",
+        rpm_capacity, config.RPM_LIMIT / 60.0, 1,
+        tpm_capacity, config.TPM_LIMIT / 60.0, float(input_tokens),
+        now, now - 60, int(config.RPM_LIMIT), unique_id, strict_rpm,
+    ]
+
+async def background_worker(redis_client: redis.Redis, llm_redis_client: redis.Redis):
     async with aiohttp.ClientSession() as session:
         while True:
             if REQUEST_QUEUE.empty():
                 await asyncio.sleep(SCHEDULER_LOOP_SLEEP_SECONDS)
                 continue
 
-            request_id, payload, event = await REQUEST_QUEUE.get()
-            input_tokens = count_input_tokens(payload)
+            request_id, payload, event, enqueued_at = await REQUEST_QUEUE.get()
+            # payload가 bytes이면 passthrough 모드 (process_request 참고, 배치에는 포함되지 않음)
+            passthrough = isinstance(payload, bytes)
+            batch = [((request_id, payload, event, enqueued_at), request_input_tokens(payload))]
+            if config.MICRO_BATCH_ENABLED and is_batchable(payload, batch[0][1]):
+                batch = await collect_batch(batch[0])
+            input_tokens = sum(tokens for _, tokens in batch)
             now = time.time()
-            
-            # --- BURST_FACTOR 반영: 초기 버킷 용량을 제한해 초기 스파이크 제어 ---
-            rpm_capacity = float(config.RPM_LIMIT) * float(getattr(config, 'BURST_FACTOR', 1.0))
-            tpm_capacity = float(config.TPM_LIMIT) * float(getattr(config, 'BURST_FACTOR', 1.0))
 
+            # 배치는 업스트림 호출 1회이므로 RPM 1 단위, TPM은 배치 전체 입력 토큰으로 승인
             unique_id = str(uuid.uuid4())
-            apim_prefix = config.APIM_USAGE_PREFIX
-            one_minute_ago = now - 60
-            result = await redis_client.eval(
-                lua_schedule, 3,
-                f"{apim_prefix}:rpm_capacity", f"{apim_prefix}:tpm_capacity", f"{apim_prefix}:rpm_window",
-                rpm_capacity, config.RPM_LIMIT / 60.0, 1,
-                tpm_capacity, config.TPM_LIMIT / 60.0, float(input_tokens),
-                now, one_minute_ago, int(config.RPM_LIMIT), unique_id
-            )
+            result = await redis_client.eval(LUA_SCHEDULE, *admission_script_args(now, input_tokens, unique_id))
 
             if result[0] != 'OK':
                 wait_time = 0.02
@@ -117,10 +209,12 @@ async def background_worker(redis_client: redis.Redis, llm_redis_client: redis.R
                         wait_time = max(0.02, float(result[1]))
                     except Exception:
                         wait_time = 0.02
-                await REQUEST_QUEUE.put((request_id, payload, event))
+                for item, _ in batch:
+                    await REQUEST_QUEUE.put(item)
                 await asyncio.sleep(wait_time)
                 continue
 
+            admitted_at = time.monotonic()
             today_str, one_minute_ago = datetime.now(timezone.utc).strftime("%Y-%m-%d"), now - 60
             
             # --- 수정된 부분: 양쪽 서버의 모니터링 키를 모두 정리 ---
@@ -142,22 +236,42 @@ async def background_worker(redis_client: redis.Redis, llm_redis_client: redis.R
 
             # 2. APIM 서버 RPM 기록은 Lua에서 이미 ZADD 처리됨 (TTL 포함)
             
+            upstream_started_at = time.monotonic()
+            request_ids = [item[0] for item, _ in batch]
             try:
+                if len(batch) == 1:
+                    upstream_url, upstream_payload, log_label = config.APIM_URL, payload, request_id
+                else:
+                    upstream_url, upstream_payload = config.APIM_BATCH_URL, build_batch_payload([item[1] for item, _ in batch])
+                    log_label = f"{request_id} (batch of {len(batch)})"
                 headers = {"Authorization": f"Bearer {config.LLM_APIM_API_KEY}"}
-                response_json, response_status = None, 500
+                if passthrough:
+                    post_kwargs = {"data": upstream_payload, "headers": {**headers, "Content-Type": "application/json"}}
+                else:
+                    post_kwargs = {"json": upstream_payload, "headers": headers}
+                response_json, response_status, response_headers = None, 500, None
                 for attempt in range(MAX_RETRIES):
                     try:
-                        async with session.post(config.APIM_URL, json=payload, headers=headers, timeout=60) as response:
-                            response_json, response_status = await response.json(), response.status
+                        async with session.post(upstream_url, timeout=60, **post_kwargs) as response:
+                            if passthrough:
+                                response_json, response_headers = await response.read(), passthrough_headers(response.headers)
+                            else:
+                                response_json = await response.json()
+                            response_status = response.status
                             if response.status < 500: break
-                            logging.warning(f"Req {request_id}: Attempt {attempt+1}/{MAX_RETRIES} failed with {response.status}. Retrying...")
+                            logging.warning(f"Req {log_label}: Attempt {attempt+1}/{MAX_RETRIES} failed with {response.status}. Retrying...")
                     except Exception as e:
-                        logging.error(f"Req {request_id}: Attempt {attempt+1}/{MAX_RETRIES} error: {e}. Retrying...")
+                        logging.error(f"Req {log_label}: Attempt {attempt+1}/{MAX_RETRIES} error: {e}. Retrying...")
                     if attempt < MAX_RETRIES - 1: await asyncio.sleep(RETRY_COOLDOWN_SECONDS)
                 
-                if response_json:
+                if response_json is not None:
+                    # 배치 응답은 요청별 결과로 분리, 배치 오류(non-200)는 모든 요청에 그대로 전달
+                    results = [(response_json, response_status, response_headers)] * len(batch)
                     if response_status == 200:
-                        output_tokens = count_output_tokens(response_json)
+                        if len(batch) == 1:
+                            output_tokens = count_body_output_tokens(response_json) if passthrough else count_output_tokens(response_json)
+                        else:
+                            results, output_tokens = split_batch_response(response_json, len(batch))
                         # 3. 양쪽 서버의 TPD, TPM 최종 기록 (TTL 부여)
                         tpm_member = f"{input_tokens}:{output_tokens}:{unique_id}"
                         await llm_redis_client.incrby(f"{llm_prefix}:tpd:{today_str}", input_tokens + output_tokens)
@@ -168,14 +282,25 @@ async def background_worker(redis_client: redis.Redis, llm_redis_client: redis.R
                         await redis_client.incrby(f"{apim_prefix}:tpd:{today_str}", input_tokens + output_tokens)
                         await redis_client.zadd(f"{apim_prefix}:tpm_window", {tpm_member: now})
                         await redis_client.expire(f"{apim_prefix}:tpm_window", 120)
-                    RESULTS_STORE[request_id] = (response_json, response_status)
+                    for rid, item_result in zip(request_ids, results):
+                        RESULTS_STORE[rid] = item_result
                 else:
-                    RESULTS_STORE[request_id] = ({"error": f"Failed after {MAX_RETRIES} attempts."}, 503)
+                    for rid in request_ids:
+                        RESULTS_STORE[rid] = ({"error": f"Failed after {MAX_RETRIES} attempts."}, 503, None)
             except Exception as e:
-                RESULTS_STORE[request_id] = ({"error": str(e)}, 500)
+                for rid in request_ids:
+                    RESULTS_STORE[rid] = ({"error": str(e)}, 500, None)
             finally:
-                event.set()
-                REQUEST_QUEUE.task_done()
+                upstream_ms = f"{(time.monotonic() - upstream_started_at) * 1000:.3f}"
+                for (rid, _, item_event, item_enqueued_at), _ in batch:
+                    # 504(큐 타임아웃)로 이미 응답한 요청은 읽는 쪽이 없으므로 기록하지 않음
+                    if rid in COMPLETION_EVENTS:
+                        REQUEST_TIMINGS[rid] = {
+                            QUEUE_WAIT_HEADER: f"{(admitted_at - item_enqueued_at) * 1000:.3f}",
+                            UPSTREAM_TIME_HEADER: upstream_ms,
+                        }
+                    item_event.set()
+                    REQUEST_QUEUE.task_done()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -208,15 +333,20 @@ app = FastAPI(title="LLM Request APIM", lifespan=lifespan)
 @app.post("/v1/chat/completions")
 async def process_request(request: Request):
     request_id = str(uuid.uuid4())
-    payload = await request.json()
+    # passthrough 모드에서는 본문을 파싱하지 않고 원본 바이트 그대로 큐에 적재합니다. (micro-batching 사용 시에는 JSON 경로)
+    passthrough = config.PASSTHROUGH_MODE and not config.MICRO_BATCH_ENABLED
+    payload = await request.body() if passthrough else await request.json()
     event = asyncio.Event()
     COMPLETION_EVENTS[request_id] = event
-    await REQUEST_QUEUE.put((request_id, payload, event))
+    await REQUEST_QUEUE.put((request_id, payload, event, time.monotonic()))
     try:
         await asyncio.wait_for(event.wait(), timeout=300.0)
     except asyncio.TimeoutError:
         return JSONResponse(content={"error": "Request timed out in APIM queue."}, status_code=status.HTTP_504_GATEWAY_TIMEOUT)
     finally:
-        result_payload, result_status = RESULTS_STORE.pop(request_id, ({"error": "Result not found"}, 500))
+        result_payload, result_status, result_headers = RESULTS_STORE.pop(request_id, ({"error": "Result not found"}, 500, None))
         COMPLETION_EVENTS.pop(request_id, None)
-    return JSONResponse(content=result_payload, status_code=result_status)
\ No newline at end of file
+        timing_headers = REQUEST_TIMINGS.pop(request_id, {})
+    if isinstance(result_payload, bytes):
+        return Response(content=result_payload, status_code=result_status, headers={**(result_headers or {}), **timing_headers})
+    return JSONResponse(content=result_payload, status_code=result_status, headers=timing_headers)
\ No newline at end of file
@@ -0,0 +1,370 @@
+"""
+APIM + LLM Mock 스택용 open-loop 부하 생성기
+
+client.py는 고정된 프롬프트를 한 번에 보내고(closed loop) 전체 소요 시간만 보여주므로
+큐 대기 시간이 가려집니다(coordinated omission). 이 도구는 응답과 무관하게 정해진 도착 시각에
+요청을 보내고, 지연 시간을 "예정된 전송 시각" 기준으로 측정합니다.
+
+- 도착 패턴: Poisson(--rpm) 또는 trace 재생(--trace, jsonl 한 줄당 요청 1건)
+    trace 라인 형식: {"t": 0.25, "messages": [...]} 또는 {"t": 0.25, "prompt": "..."}
+    "t"(초, 시작 시점 기준 오프셋)가 없으면 --rpm Poisson 간격으로 보냅니다.
+- 지연 시간: HDR 스타일 로그-선형 히스토그램 (total / queue_wait / upstream / overhead / send_lag)
+    queue_wait, upstream 은 APIM 응답 헤더(X-APIM-Queue-Wait-Ms, X-APIM-Upstream-Ms) 값입니다.
+- 처리량: 클라이언트 기준 achieved RPM/TPM 과 APIM Redis 60초 윈도우 샘플을 config.RPM_LIMIT/TPM_LIMIT 와 비교
+- 리포트: JSON 파일(--report), --baseline 으로 이전 리포트와 비교해 회귀 시 exit code 1
+
+실행 (프로젝트 루트에서, APIM/LLM/Redis 실행 중):
+    python -m benchmarks.loadgen --rpm 90 --duration 120
+    python -m benchmarks.loadgen --trace my_trace.jsonl --time-scale 10 --report run2.json --baseline run1.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+import redis
+
+import config
+from apim_server.apim_server import QUEUE_WAIT_HEADER, UPSTREAM_TIME_HEADER, count_input_tokens, count_output_tokens
+from client import DEFAULT_API_KEY, DEFAULT_API_URL
+from monitor import get_minute_usage
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+# --- 부하 생성 기본값 ---
+DEFAULT_DURATION_SECONDS = 60.0
+REQUEST_TIMEOUT_SECONDS = 310  # APIM 큐 타임아웃(300초)보다 약간 길게
+REDIS_SAMPLE_INTERVAL_SECONDS = 1.0
+DEFAULT_MAX_REGRESSION = 0.10  # baseline 대비 허용 악화 비율
+LATENCY_METRICS = ("total", "queue_wait", "upstream", "overhead", "send_lag")
+REPORT_PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+class LatencyHistogram:
+    """
+    HdrHistogram과 같은 로그-선형 버킷 히스토그램 (마이크로초 단위)
+    HdrHistogram과 같이 값의 상위 sub_bucket_bits+1 비트를 유지해 2의 거듭제곱 구간마다 2**sub_bucket_bits 개로
+    균등 분할하므로(sub-bucket 값 범위 2**sub_bucket_bits ~ 2**(sub_bucket_bits+1)-1) 상대 오차가 1/2**sub_bucket_bits 이하입니다.
+    """
+    def __init__(self, sub_bucket_bits: int = 7):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.counts: Dict[Tuple[int, int], int] = {}
+        self.total_count = 0
+        self.min_us: Optional[int] = None
+        self.max_us = 0
+        self.sum_us = 0
+
+    def record(self, seconds: float):
+        value_us = max(0, int(seconds * 1_000_000))
+        shift = max(0, value_us.bit_length() - self.sub_bucket_bits - 1)
+        bucket = (shift, value_us >> shift)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.total_count += 1
+        self.sum_us += value_us
+        if value_us > self.max_us:
+            self.max_us = value_us
+        if self.min_us is None or value_us < self.min_us:
+            self.min_us = value_us
+
+    def _bucket_upper_us(self, bucket: Tuple[int, int]) -> int:
+        shift, sub_bucket = bucket
+        return ((sub_bucket + 1) << shift) - 1
+
+    def value_at_percentile(self, percentile: float) -> int:
+        if self.total_count == 0:
+            return 0
+        target = max(1, math.ceil(percentile / 100.0 * self.total_count))
+        seen = 0
+        for bucket in sorted(self.counts, key=self._bucket_upper_us):
+            seen += self.counts[bucket]
+            if seen >= target:
+                return min(self._bucket_upper_us(bucket), self.max_us)
+        return self.max_us
+
+    def to_dict(self) -> Dict[str, Any]:
+        ms = lambda us: round(us / 1000.0, 3)
+        return {
+            "count": self.total_count,
+            "min_ms": ms(self.min_us or 0),
+            "mean_ms": ms(self.sum_us / self.total_count) if self.total_count else 0.0,
+            "max_ms": ms(self.max_us),
+            "percentiles_ms": {f"p{p:g}": ms(self.value_at_percentile(p)) for p in REPORT_PERCENTILES},
+            # [버킷 상한(us), 개수] - 여러 실행 결과를 합치거나 분포를 다시 그릴 때 사용
+            "buckets": [[self._bucket_upper_us(b), self.counts[b]] for b in sorted(self.counts, key=self._bucket_upper_us)],
+        }
+
+def load_trace(path: str) -> List[Dict[str, Any]]:
+    """trace jsonl 파일을 읽어 {"t": Optional[float], "payload": dict} 목록으로 반환합니다."""
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if "messages" in record:
+                payload = {"messages": record["messages"]}
+            elif "prompt" in record:
+                payload = {"messages": [{"role": "user", "content": record["prompt"]}]}
+            else:
+                raise ValueError(f"{path}:{line_no}: trace line needs 'messages' or 'prompt'")
+            if "model" in record:
+                payload["model"] = record["model"]
+            entries.append({"t": record.get("t"), "payload": payload})
+    return entries
+
+def build_schedule(args: argparse.Namespace, rng: random.Random) -> List[Tuple[float, Dict[str, Any]]]:
+    """(시작 기준 예정 전송 시각, payload) 목록을 만듭니다. 응답과 무관하게 미리 결정됩니다(open loop)."""
+    mean_gap = 60.0 / args.rpm if args.rpm > 0 else 0.0
+    schedule = []
+    if args.trace:
+        t = 0.0
+        for entry in load_trace(args.trace):
+            if entry["t"] is not None:
+                t = float(entry["t"]) / args.time_scale
+            else:
+                if mean_gap <= 0:
+                    raise ValueError("trace lines without 't' need --rpm for Poisson spacing")
+                t += rng.expovariate(1.0 / mean_gap)
+            if args.duration and t > args.duration:
+                break
+            schedule.append((t, entry["payload"]))
+        schedule.sort(key=lambda x: x[0])
+    else:
+        if mean_gap <= 0:
+            raise ValueError("--rpm must be > 0 for Poisson arrivals")
+        t = rng.expovariate(1.0 / mean_gap)
+        i = 0
+        while t <= args.duration:
+            prompt = f"This is a load test prompt number {i}."
+            schedule.append((t, {"messages": [{"role": "user", "content": prompt}]}))
+            t += rng.expovariate(1.0 / mean_gap)
+            i += 1
+    return schedule
+
+async def _send_scheduled_request(
+    session: aiohttp.ClientSession,
+    api_url: str,
+    payload: Dict[str, Any],
+    intended_at: float,
+    results: List[Dict[str, Any]],
+):
+    """예정 시각(intended_at, loop.time 기준)에 맞춰 호출된 단일 요청을 보내고 결과를 기록합니다."""
+    loop = asyncio.get_running_loop()
+    sent_at = loop.time()
+    result: Dict[str, Any] = {"intended_at": intended_at, "send_lag": sent_at - intended_at, "status": None}
+    try:
+        async with session.post(api_url, json=payload, headers={"Authorization": f"Bearer {DEFAULT_API_KEY}"}) as response:
+            body = await response.read()
+            result["status"] = response.status
+            queue_wait_ms = response.headers.get(QUEUE_WAIT_HEADER)
+            upstream_ms = response.headers.get(UPSTREAM_TIME_HEADER)
+            result["queue_wait"] = float(queue_wait_ms) / 1000.0 if queue_wait_ms is not None else None
+            result["upstream"] = float(upstream_ms) / 1000.0 if upstream_ms is not None else None
+            if response.status == 200:
+                result["tokens"] = count_input_tokens(payload) + count_output_tokens(json.loads(body))
+    except Exception as e:
+        result["error"] = str(e)
+    result["completed_at"] = loop.time()
+    result["total"] = result["completed_at"] - intended_at
+    results.append(result)
+
+async def _sample_redis_windows(stop: asyncio.Event, samples: List[Dict[str, float]], started_at: float):
+    """APIM Redis의 60초 윈도우(rpm_window/tpm_window)를 주기적으로 샘플링합니다."""
+    r_gateway = redis.Redis(host=config.REDIS_HOST, port=config.REDIS_PORT, db=config.APIM_REDIS_DB, decode_responses=True)
+    loop = asyncio.get_running_loop()
+    try:
+        while not stop.is_set():
+            try:
+                rpm, tpm = await asyncio.to_thread(get_minute_usage, r_gateway, config.APIM_USAGE_PREFIX, True)
+                samples.append({"t": round(loop.time() - started_at, 3), "rpm": rpm, "tpm": tpm})
+            except redis.exceptions.ConnectionError as e:
+                logging.warning(f"Redis sampling disabled: {e}")
+                return
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=REDIS_SAMPLE_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        r_gateway.close()
+
+async def run_load(args: argparse.Namespace) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    schedule = build_schedule(args, rng)
+    logging.info(f"--- Open-loop run: {len(schedule)} requests over {schedule[-1][0] if schedule else 0:.1f}s to {args.url} ---")
+
+    results: List[Dict[str, Any]] = []
+    redis_samples: List[Dict[str, float]] = []
+    stop_sampling = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    # limit=0: 커넥션 풀 대기가 클라이언트 측 큐잉(coordinated omission)을 만들지 않도록 제한 해제
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT_SECONDS)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        started_at = loop.time()
+        sampler = None if args.no_redis else asyncio.create_task(_sample_redis_windows(stop_sampling, redis_samples, started_at))
+        tasks = []
+        for offset, payload in schedule:
+            intended_at = started_at + offset
+            delay = intended_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(_send_scheduled_request(session, args.url, payload, intended_at, results)))
+        await asyncio.gather(*tasks)
+        finished_at = loop.time()
+        stop_sampling.set()
+        if sampler:
+            await sampler
+
+    return build_report(args, schedule, results, redis_samples, finished_at - started_at)
+
+def build_report(
+    args: argparse.Namespace,
+    schedule: List[Tuple[float, Dict[str, Any]]],
+    results: List[Dict[str, Any]],
+    redis_samples: List[Dict[str, float]],
+    elapsed: float,
+) -> Dict[str, Any]:
+    histograms = {name: LatencyHistogram() for name in LATENCY_METRICS}
+    status_counts: Dict[str, int] = {}
+    succeeded, total_tokens = 0, 0
+    for r in results:
+        status_key = str(r["status"]) if r["status"] is not None else "client_error"
+        status_counts[status_key] = status_counts.get(status_key, 0) + 1
+        histograms["send_lag"].record(r["send_lag"])
+        if r["status"] != 200:
+            continue
+        succeeded += 1
+        total_tokens += r.get("tokens", 0)
+        histograms["total"].record(r["total"])
+        if r.get("queue_wait") is not None and r.get("upstream") is not None:
+            histograms["queue_wait"].record(r["queue_wait"])
+            histograms["upstream"].record(r["upstream"])
+            histograms["overhead"].record(max(0.0, r["total"] - r["queue_wait"] - r["upstream"]))
+
+    offered_span = schedule[-1][0] if schedule else 0.0
+    minutes = elapsed / 60.0 if elapsed > 0 else 0.0
+    achieved_rpm = succeeded / minutes if minutes else 0.0
+    achieved_tpm = total_tokens / minutes if minutes else 0.0
+
+    # 60초 윈도우가 채워진 이후 샘플만 정상 상태(steady state)로 간주
+    steady = [s for s in redis_samples if s["t"] >= 60.0] or redis_samples
+    redis_window = None
+    if steady:
+        redis_window = {
+            "samples": len(redis_samples),
+            "max_rpm": max(s["rpm"] for s in steady),
+            "mean_rpm": round(sum(s["rpm"] for s in steady) / len(steady), 2),
+            "max_tpm": max(s["tpm"] for s in steady),
+            "mean_tpm": round(sum(s["tpm"] for s in steady) / len(steady), 2),
+            "rpm_utilization": round(max(s["rpm"] for s in steady) / config.RPM_LIMIT, 4),
+            "tpm_utilization": round(max(s["tpm"] for s in steady) / config.TPM_LIMIT, 4),
+            "rpm_limit_exceeded": any(s["rpm"] > config.RPM_LIMIT for s in redis_samples),
+            "tpm_limit_exceeded": any(s["tpm"] > config.TPM_LIMIT for s in redis_samples),
+            "series": redis_samples,
+        }
+
+    return {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "params": {
+            "url": args.url,
+            "mode": "trace" if args.trace else "poisson",
+            "trace": args.trace,
+            "target_rpm": args.rpm,
+            "duration_seconds": args.duration,
+            "time_scale": args.time_scale,
+            "seed": args.seed,
+        },
+        "limits": {
+            "rpm_limit": config.RPM_LIMIT,
+            "tpm_limit": config.TPM_LIMIT,
+            "burst_factor": config.BURST_FACTOR,
+            "enforce_strict_rpm": config.ENFORCE_STRICT_RPM,
+        },
+        "requests": {
+            "scheduled": len(schedule),
+            "completed": len(results),
+            "succeeded": succeeded,
+            "status_counts": status_counts,
+        },
+        "throughput": {
+            "elapsed_seconds": round(elapsed, 3),
+            "offered_rpm": round(len(schedule) / (offered_span / 60.0), 2) if offered_span > 0 else 0.0,
+            "achieved_rpm": round(achieved_rpm, 2),
+            "achieved_tpm": round(achieved_tpm, 2),
+            "rpm_vs_limit": round(achieved_rpm / config.RPM_LIMIT, 4),
+            "tpm_vs_limit": round(achieved_tpm / config.TPM_LIMIT, 4),
+        },
+        "redis_window": redis_window,
+        "latency": {name: h.to_dict() for name, h in histograms.items()},
+    }
+
+def compare_with_baseline(report: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    """baseline 대비 악화된 지표 목록을 반환합니다. (지연 시간 p99 증가, 처리량 감소, 한도 초과)"""
+    regressions = []
+    for metric in ("total", "queue_wait"):
+        old = baseline["latency"][metric]["percentiles_ms"]["p99"]
+        new = report["latency"][metric]["percentiles_ms"]["p99"]
+        if old > 0 and new > old * (1 + max_regression):
+            regressions.append(f"{metric} p99 {old:.1f}ms -> {new:.1f}ms")
+    old_rpm, new_rpm = baseline["throughput"]["achieved_rpm"], report["throughput"]["achieved_rpm"]
+    if old_rpm > 0 and new_rpm < old_rpm * (1 - max_regression):
+        regressions.append(f"achieved_rpm {old_rpm:.1f} -> {new_rpm:.1f}")
+    window = report.get("redis_window") or {}
+    if window.get("rpm_limit_exceeded") or window.get("tpm_limit_exceeded"):
+        regressions.append("Redis 60s window exceeded RPM/TPM limit")
+    return regressions
+
+def print_summary(report: Dict[str, Any]):
+    req, tp = report["requests"], report["throughput"]
+    logging.info(f"Requests: scheduled={req['scheduled']} succeeded={req['succeeded']} status={req['status_counts']}")
+    logging.info(f"Throughput: offered={tp['offered_rpm']} RPM, achieved={tp['achieved_rpm']} RPM ({tp['rpm_vs_limit']:.1%} of limit), "
+                 f"{tp['achieved_tpm']} TPM ({tp['tpm_vs_limit']:.1%} of limit)")
+    if report["redis_window"]:
+        w = report["redis_window"]
+        logging.info(f"Redis window: max RPM={w['max_rpm']} ({w['rpm_utilization']:.1%}), max TPM={w['max_tpm']} ({w['tpm_utilization']:.1%})")
+    for name, h in report["latency"].items():
+        pcts = " ".join(f"{k}={v:.1f}" for k, v in h["percentiles_ms"].items())
+        logging.info(f"{name.ljust(10)} (ms): n={h['count']} mean={h['mean_ms']:.1f} {pcts} max={h['max_ms']:.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Open-loop load generator for the APIM + LLM mock stack")
+    parser.add_argument("--url", default=DEFAULT_API_URL)
+    parser.add_argument("--rpm", type=float, default=float(config.RPM_LIMIT), help="Poisson 평균 도착률 (requests/min)")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION_SECONDS, help="부하 시간(초), trace는 이 시간 이후 라인을 잘라냄")
+    parser.add_argument("--trace", help="trace 재생용 jsonl 파일")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="trace 시각을 이 값으로 나눔 (2.0 = 2배 빠르게)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-redis", action="store_true", help="Redis 윈도우 샘플링 생략")
+    parser.add_argument("--report", default="loadgen_report.json", help="JSON 리포트 출력 경로")
+    parser.add_argument("--baseline", help="비교할 이전 JSON 리포트")
+    parser.add_argument("--max-regression", type=float, default=DEFAULT_MAX_REGRESSION)
+    args = parser.parse_args()
+
+    report = asyncio.run(run_load(args))
+    print_summary(report)
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    logging.info(f"Report written to {args.report}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(report, baseline, args.max_regression)
+        if regressions:
+            for r in regressions:
+                logging.error(f"REGRESSION: {r}")
+            sys.exit(1)
+        logging.info("No regressions against baseline.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+APIM 본문 처리 경로 CPU 벤치마크 (기존 JSON 방식 vs passthrough 방식)
+
+네트워크/Redis를 제외하고, 요청 1건당 APIM 프로세스가 본문에 대해 수행하는 작업만 재현합니다.
+- json       : request.json() -> count_input_tokens -> json= 재인코딩 -> response.json()
+               -> count_output_tokens -> JSONResponse 재직렬화
+- passthrough: count_body_input_tokens(요청) -> count_body_output_tokens(응답) -> Response(원본 바이트)
+
+케이스: small / large(메시지 1개의 긴 문자열) / multi-turn(짧은 메시지 수천 개) / escaped(따옴표·역슬래시·개행·비ASCII가 많은 본문)
+
+주의: 본문 처리 비용만 측정합니다. FastAPI 라우팅, aiohttp 업스트림 호출, Redis 왕복은 포함되지 않으므로
+"body-only RPS/core"는 APIM이 실제로 낼 수 있는 처리량이 아니라 본문 처리만의 상한이며,
+speedup도 전체 요청 처리 대비가 아닌 본문 처리 구간의 개선 비율입니다.
+서버 수준(FastAPI + aiohttp + Redis 포함)의 요청당 CPU와 코어당 최대 RPS는 측정하지 않았습니다.
+측정하려면 RPM_LIMIT/TPM_LIMIT를 충분히 높인 APIM을 PASSTHROUGH_MODE=False/True로 각각 띄우고,
+benchmarks.loadgen의 --rpm을 올려 가며 APIM 프로세스의 CPU 사용률과 달성 RPM을 함께 기록해야 합니다.
+
+실행 (프로젝트 루트에서):
+    python -m benchmarks.passthrough_bench
+    python -m benchmarks.passthrough_bench --iterations 2000 --large-kb 256
+"""
+import argparse
+import json
+import time
+from typing import Callable, Dict, Tuple
+
+from fastapi.responses import JSONResponse, Response
+
+from apim_server.apim_server import (
+    count_body_input_tokens,
+    count_body_output_tokens,
+    count_input_tokens,
+    count_output_tokens,
+    passthrough_headers,
+)
+
+# --- 벤치마크 기본값 ---
+DEFAULT_ITERATIONS = 5000
+DEFAULT_LARGE_KB = 128
+SMALL_PROMPT = "Classify the sentiment of this sentence: 오늘 날씨가 정말 좋네요!"
+ESCAPE_HEAVY_TEXT = 'He said "yes", then \\"no\\" -> C:\\tmp\\a.txt\n\t"quoted" 안녕 😀\n'
+MULTI_TURN_CHARS = 60  # many-messages 케이스의 메시지당 글자 수
+UPSTREAM_HEADERS = {
+    "content-type": "application/json",
+    "content-length": "0",
+    "date": "Mon, 01 Jan 2024 00:00:00 GMT",
+    "server": "uvicorn",
+}
+
+def _repeat(text: str, chars: int) -> str:
+    return (text * (chars // len(text) + 1))[:chars]
+
+def build_payloads(prompt_chars: int, completion_chars: int, text: str = SMALL_PROMPT,
+                   completion_text: str = "positive\n", turn_chars: int = 0) -> Tuple[bytes, bytes]:
+    """
+    클라이언트 요청 본문과 업스트림(LLM) 응답 본문을 원본 바이트로 생성합니다.
+    turn_chars > 0이면 프롬프트를 그 길이의 user/assistant 메시지 여러 개(멀티턴 대화)로 나눕니다.
+    """
+    prompt = _repeat(text, prompt_chars)
+    completion = _repeat(completion_text, completion_chars)
+    if turn_chars > 0:
+        chunks = [prompt[i:i + turn_chars] for i in range(0, len(prompt), turn_chars)]
+        messages = [{"role": "assistant" if i % 2 else "user", "content": chunk} for i, chunk in enumerate(chunks)]
+    else:
+        messages = [{"role": "user", "content": prompt}]
+    request_body = json.dumps({"model": "gpt-4o", "messages": messages}).encode("utf-8")
+    response_body = json.dumps({
+        "id": "chat_completions-bench",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "gpt-4o",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": completion}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 15, "completion_tokens": 20, "total_tokens": 35},
+    }).encode("utf-8")
+    return request_body, response_body
+
+def json_path(request_body: bytes, response_body: bytes) -> int:
+    payload = json.loads(request_body)
+    input_tokens = count_input_tokens(payload)
+    json.dumps(payload).encode("utf-8")  # aiohttp session.post(json=...)의 기본 직렬화
+    response_json = json.loads(response_body.decode("utf-8"))
+    output_tokens = count_output_tokens(response_json)
+    JSONResponse(content=response_json, status_code=200)
+    return input_tokens + output_tokens
+
+def passthrough_path(request_body: bytes, response_body: bytes) -> int:
+    input_tokens = count_body_input_tokens(request_body)
+    output_tokens = count_body_output_tokens(response_body)
+    Response(content=response_body, status_code=200, headers=passthrough_headers(UPSTREAM_HEADERS))
+    return input_tokens + output_tokens
+
+def measure(fn: Callable[[bytes, bytes], int], request_body: bytes, response_body: bytes, iterations: int) -> Dict[str, float]:
+    """process CPU 시간 기준으로 요청당 본문 처리 CPU 사용량과 본문 처리만 했을 때의 코어당 RPS 상한을 계산합니다."""
+    for _ in range(min(100, iterations)):
+        fn(request_body, response_body)
+    start = time.process_time()
+    for _ in range(iterations):
+        fn(request_body, response_body)
+    cpu_seconds = time.process_time() - start
+    cpu_per_request = cpu_seconds / iterations
+    return {
+        "cpu_us_per_request": cpu_per_request * 1e6,
+        "body_only_rps_per_core": 1.0 / cpu_per_request if cpu_per_request > 0 else float("inf"),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="APIM passthrough body-handling CPU benchmark (excludes FastAPI/aiohttp/Redis)")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument("--large-kb", type=int, default=DEFAULT_LARGE_KB, help="large 케이스의 요청/응답 content 크기(KB)")
+    args = parser.parse_args()
+
+    large_chars = args.large_kb * 1024
+    cases = {
+        "small": build_payloads(len(SMALL_PROMPT), 8),
+        f"large({args.large_kb}KB)": build_payloads(large_chars, large_chars),
+        f"multi-turn({args.large_kb}KB)": build_payloads(large_chars, large_chars, turn_chars=MULTI_TURN_CHARS),
+        f"escaped({args.large_kb}KB)": build_payloads(large_chars, large_chars, text=ESCAPE_HEAVY_TEXT,
+                                                      completion_text=ESCAPE_HEAVY_TEXT),
+    }
+
+    print(f"{'case'.ljust(18)} {'mode'.ljust(12)} {'req/resp bytes'.rjust(18)} {'body CPU us/req'.rjust(16)} {'body-only RPS/core'.rjust(19)}")
+    for case_name, (request_body, response_body) in cases.items():
+        # 두 경로의 토큰 집계 결과가 같아야 비교 의미가 있습니다.
+        expected = json_path(request_body, response_body)
+        actual = passthrough_path(request_body, response_body)
+        if expected != actual:
+            raise SystemExit(f"[{case_name}] token count mismatch: json={expected}, passthrough={actual}")
+
+        # 큰 본문은 반복 횟수를 줄여 실행 시간을 비슷하게 맞춥니다.
+        iterations = args.iterations if case_name == "small" else max(1, args.iterations // 50)
+        results = {}
+        for mode, fn in (("json", json_path), ("passthrough", passthrough_path)):
+            results[mode] = measure(fn, request_body, response_body, iterations)
+            sizes = f"{len(request_body)}/{len(response_body)}"
+            print(f"{case_name.ljust(18)} {mode.ljust(12)} {sizes.rjust(18)} "
+                  f"{results[mode]['cpu_us_per_request']:16.1f} {results[mode]['body_only_rps_per_core']:19.0f}")
+        speedup = results["json"]["cpu_us_per_request"] / results["passthrough"]["cpu_us_per_request"]
+        print(f"{case_name.ljust(18)} {'body speedup'.ljust(12)} {''.rjust(18)} {speedup:15.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+"""
+APIM 스케줄러(admission) 가상 시계 시뮬레이터
+
+background_worker의 LUA_SCHEDULE(토큰 버킷 + 60초 슬라이딩 윈도우)과 같은 로직을 Python으로 재현하고,
+워커 루프(FIFO 큐, WAIT 시 맨 뒤로 재적재 후 대기, 승인 후 업스트림 호출 동안 블로킹, micro-batching)를
+가상 시계 위에서 이산 사건 방식으로 실행합니다. 실제 서버/Redis 없이 BURST_FACTOR, ENFORCE_STRICT_RPM,
+충전 속도 변경의 영향을 하루 단위 트래픽으로 빠르게 확인할 수 있습니다.
+
+- 도착 패턴: poisson / constant / bursty(on-off) 또는 trace 재생(--trace, benchmarks.loadgen 형식)
+- MICRO_BATCH_ENABLED(--micro-batch on): 워커와 같이 큐 맨 앞의 batchable 요청을 linger 동안 모아
+  admission 1회(RPM 1 단위, TPM은 배치 입력 토큰 합계)와 업스트림 호출 1회로 처리
+- 결과: 승인률, 큐 대기 시간 분포(HDR 스타일), 최악의 60초 윈도우 업스트림 호출/토큰 수
+- --differential: 같은 admission 호출 순서를 로컬 Redis의 실제 LUA_SCHEDULE에도 보내 결과를 비교
+  (별도 key prefix 사용, 불일치 시 exit code 1)
+
+실행 (프로젝트 루트에서):
+    python -m benchmarks.simulator --rpm 10000 --hours 24 --rpm-limit 10000 --tpm-limit 1000000
+    python -m benchmarks.simulator --pattern bursty --burst-factor 0.2 --strict-rpm off
+    python -m benchmarks.simulator --differential --hours 0.1
+    python -m benchmarks.simulator --rpm 30000 --hours 1 --micro-batch on
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import config
+from apim_server.apim_server import LUA_SCHEDULE, SCHEDULER_LOOP_SLEEP_SECONDS, admission_script_args, count_input_tokens, is_batchable
+from benchmarks.loadgen import LatencyHistogram, load_trace
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+# --- 시뮬레이션 기본값 ---
+SIM_START_TS = 1_700_000_000.0  # 가상 시계 시작 시각 (epoch seconds)
+DEFAULT_TOKENS_PER_REQUEST = 40
+DEFAULT_SERVICE_SECONDS = 0.003   # 승인 후 업스트림 호출 + 모니터링 기록 동안 워커가 블로킹되는 시간
+DEFAULT_EVAL_SECONDS = 0.0002     # Lua eval 1회 왕복 시간
+MIN_WAIT_SECONDS = 0.02           # background_worker의 WAIT 시 최소 대기 시간
+APIM_QUEUE_TIMEOUT_SECONDS = 300.0
+SIM_KEY_PREFIX = "apim_sim"
+DIFFERENTIAL_REL_TOLERANCE = 1e-9
+
+class AdmissionModel:
+    """
+    LUA_SCHEDULE과 같은 admission 로직의 메모리 구현
+    호출 인자는 admission_script_args()를 그대로 사용하므로 config 값 해석도 실제 워커와 동일합니다.
+    """
+    def __init__(self):
+        self.buckets: Dict[str, Tuple[float, float]] = {}  # key -> (available, last_ts)
+        self.window: deque = deque()  # rpm_window ZSET score (가상 시각은 단조 증가하므로 정렬 유지)
+
+    def admit(self, args: List[Any]) -> List[Any]:
+        _, rpm_key, tpm_key, _, rpm_cap, rpm_rate, rpm_needed, tpm_cap, tpm_rate, tpm_needed, now, one_minute_ago, rpm_limit, _, strict_rpm = args
+
+        # 1) ZREMRANGEBYSCORE -inf one_minute_ago (score <= one_minute_ago 제거) + ZCARD
+        window = self.window
+        while window and window[0] <= one_minute_ago:
+            window.popleft()
+        if strict_rpm == 1 and len(window) >= rpm_limit:
+            return ['WAIT_RPM']
+
+        # 2) 토큰 버킷 충전 및 용량 확인 (refill() 인라인)
+        buckets = self.buckets
+        rpm_available, last_ts = buckets.get(rpm_key, (rpm_cap, now))
+        if now > last_ts:
+            rpm_available = min(rpm_cap, rpm_available + (now - last_ts) * rpm_rate)
+        tpm_available, last_ts = buckets.get(tpm_key, (tpm_cap, now))
+        if now > last_ts:
+            tpm_available = min(tpm_cap, tpm_available + (now - last_ts) * tpm_rate)
+        # Redis가 Lua number reply를 정수로 변환하므로 대기 시간도 정수로 버림
+        if rpm_available < rpm_needed:
+            return ['WAIT_TOKENS', int((rpm_needed - rpm_available) / rpm_rate)]
+        if tpm_available < tpm_needed:
+            return ['WAIT_TOKENS', int((tpm_needed - tpm_available) / tpm_rate)]
+
+        # 3) 소비 및 기록
+        buckets[rpm_key] = (rpm_available - rpm_needed, now)
+        buckets[tpm_key] = (tpm_available - tpm_needed, now)
+        window.append(now)
+        return ['OK']
+
+class DifferentialAdmission:
+    """AdmissionModel과 실제 Redis의 LUA_SCHEDULE을 같은 인자로 호출해 결과를 비교합니다."""
+    def __init__(self, model: AdmissionModel, redis_client, max_calls: int):
+        self.model = model
+        self.redis_client = redis_client
+        self.script = redis_client.register_script(LUA_SCHEDULE)
+        self.max_calls = max_calls
+        self.calls = 0
+        self.mismatches: List[Dict[str, Any]] = []
+
+    def admit(self, args: List[Any]) -> List[Any]:
+        expected = self.model.admit(args)
+        if self.calls >= self.max_calls:
+            return expected
+        self.calls += 1
+        numkeys = args[0]
+        actual = self.script(keys=args[1:1 + numkeys], args=args[1 + numkeys:])
+        actual = [a.decode() if isinstance(a, bytes) else a for a in actual]
+        if not _results_match(expected, actual):
+            self.mismatches.append({"call": self.calls, "now": args[10], "python": expected, "lua": actual})
+        return expected
+
+def _results_match(expected: List[Any], actual: List[Any]) -> bool:
+    if len(expected) != len(actual) or expected[0] != actual[0]:
+        return False
+    if len(expected) > 1:
+        a, b = float(expected[1]), float(actual[1])
+        return abs(a - b) <= DIFFERENTIAL_REL_TOLERANCE * max(1.0, abs(a), abs(b))
+    return True
+
+def generate_arrivals(args: argparse.Namespace, rng: random.Random) -> Iterator[Tuple[float, int, bool]]:
+    """(가상 도착 시각, 입력 토큰 수, micro-batch 가능 여부)를 시간 순서대로 생성합니다."""
+    end = SIM_START_TS + args.hours * 3600.0
+    if args.trace:
+        t = SIM_START_TS
+        for entry in load_trace(args.trace):
+            if entry["t"] is not None:
+                t = SIM_START_TS + float(entry["t"]) / args.time_scale
+            else:
+                t += rng.expovariate(args.rpm / 60.0)
+            if t > end:
+                return
+            tokens = count_input_tokens(entry["payload"])
+            yield t, tokens, is_batchable(entry["payload"], tokens)
+        return
+
+    rate = args.rpm / 60.0
+    tokens = args.tokens_per_request
+    batchable = tokens <= config.MICRO_BATCH_MAX_INPUT_TOKENS  # 합성 트래픽은 streaming 요청이 없음
+    t = SIM_START_TS
+    if args.pattern == "constant":
+        gap = 1.0 / rate
+        while True:
+            t += gap
+            if t > end:
+                return
+            yield t, tokens, batchable
+    elif args.pattern == "poisson":
+        expovariate = rng.expovariate
+        while True:
+            t += expovariate(rate)
+            if t > end:
+                return
+            yield t, tokens, batchable
+    elif args.pattern == "bursty":
+        # 평균 도착률은 --rpm과 같고, 주기(--burst-period)의 앞쪽 --burst-duty 비율 구간에만 몰려서 도착
+        on_seconds = args.burst_period * args.burst_duty
+        on_rate = rate / args.burst_duty
+        period_start = SIM_START_TS
+        while period_start < end:
+            t = period_start
+            while True:
+                t += rng.expovariate(on_rate)
+                if t > period_start + on_seconds or t > end:
+                    break
+                yield t, tokens, batchable
+            period_start += args.burst_period
+    else:
+        raise ValueError(f"unknown pattern: {args.pattern}")
+
+def simulate(
+    arrivals: Iterator[Tuple[float, int, bool]],
+    admit: Callable[[List[Any]], List[Any]],
+    service_seconds: float,
+    eval_seconds: float,
+) -> Dict[str, Any]:
+    """
+    background_worker 루프를 가상 시계로 실행합니다.
+    큐가 비었을 때의 폴링(SCHEDULER_LOOP_SLEEP_SECONDS)은 다음 도착 시각으로 바로 건너뛰고 그 간격만큼만 반올림합니다.
+    config는 실행 중 바뀌지 않으므로 admission_script_args()는 한 번만 만들고 요청별 값(tpm_needed, now, one_minute_ago)만 바꿉니다.
+    MICRO_BATCH_ENABLED이면 collect_batch()와 같이 맨 앞의 batchable 요청을 모아 배치 1개를 admission/업스트림 호출 1회로 처리합니다.
+    """
+    script_args = admission_script_args(SIM_START_TS, 0, "", prefix=SIM_KEY_PREFIX)
+    batching = bool(config.MICRO_BATCH_ENABLED)
+    max_batch_size = config.MICRO_BATCH_MAX_SIZE
+    linger_seconds = config.MICRO_BATCH_MAX_LINGER_SECONDS
+    queue: deque = deque()
+    delays = LatencyHistogram()
+    calls_60s: deque = deque()   # (승인 시각, 토큰) - 업스트림 호출(배치는 1건) 단위
+    tokens_60s = 0
+    worst_rpm, worst_tpm = 0, 0
+    worst_rpm_at = worst_tpm_at = SIM_START_TS
+    admitted = upstream_calls = evals = waits_rpm = waits_tokens = timed_out = 0
+    per_minute: Dict[int, int] = {}
+
+    t = SIM_START_TS
+    next_arrival = next(arrivals, None)
+    while True:
+        while next_arrival is not None and next_arrival[0] <= t:
+            queue.append(next_arrival)
+            next_arrival = next(arrivals, None)
+        if not queue:
+            if next_arrival is None:
+                break
+            gap = next_arrival[0] - t
+            t += SCHEDULER_LOOP_SLEEP_SECONDS * max(1, -(-gap // SCHEDULER_LOOP_SLEEP_SECONDS))
+            continue
+
+        item = queue.popleft()
+        tokens = item[1]
+        batch = None
+        if batching and item[2]:
+            # collect_batch(): 맨 앞 요청이 batchable인 동안만 꺼내고, 큐가 비면 linger 기한까지 폴링
+            batch = [item]
+            deadline = t + linger_seconds
+            while len(batch) < max_batch_size:
+                while next_arrival is not None and next_arrival[0] <= t:
+                    queue.append(next_arrival)
+                    next_arrival = next(arrivals, None)
+                if queue:
+                    if not queue[0][2]:
+                        break
+                    batch.append(queue.popleft())
+                    tokens += batch[-1][1]
+                    continue
+                if t >= deadline:
+                    break
+                t += SCHEDULER_LOOP_SLEEP_SECONDS
+
+        now = t
+        script_args[9], script_args[10], script_args[11] = float(tokens), now, now - 60
+        script_args[13] = str(evals)  # rpm_window ZSET member (Redis 차등 테스트에서 고유해야 함)
+        result = admit(script_args)
+        evals += 1
+        t += eval_seconds
+        if result[0] != 'OK':
+            wait_time = MIN_WAIT_SECONDS
+            if result[0] == 'WAIT_TOKENS':
+                waits_tokens += 1
+                wait_time = max(MIN_WAIT_SECONDS, float(result[1]))
+            else:
+                waits_rpm += 1
+            if batch is None:
+                queue.append(item)
+            else:
+                queue.extend(batch)
+            t += wait_time
+            continue
+
+        upstream_calls += 1
+        minute = int((now - SIM_START_TS) // 60)
+        for arrived_at, _, _ in (batch or (item,)):
+            admitted += 1
+            delay = now - arrived_at
+            delays.record(delay)
+            if delay > APIM_QUEUE_TIMEOUT_SECONDS:
+                timed_out += 1  # 클라이언트는 504를 받지만 워커는 여전히 처리함 (process_request와 동일)
+            per_minute[minute] = per_minute.get(minute, 0) + 1
+
+        # 승인 시각 기준으로 끝나는 60초 슬라이딩 윈도우 (Lua와 같이 score <= now-60 제외)
+        calls_60s.append((now, tokens))
+        tokens_60s += tokens
+        while calls_60s[0][0] <= now - 60:
+            tokens_60s -= calls_60s.popleft()[1]
+        if len(calls_60s) > worst_rpm:
+            worst_rpm, worst_rpm_at = len(calls_60s), now
+        if tokens_60s > worst_tpm:
+            worst_tpm, worst_tpm_at = tokens_60s, now
+        t += service_seconds
+
+    simulated_seconds = t - SIM_START_TS
+    full_minutes = [per_minute.get(m, 0) for m in range(int(simulated_seconds // 60))]
+    return {
+        "simulated_seconds": round(simulated_seconds, 3),
+        "admitted": admitted,
+        "admitted_rpm": round(admitted / (simulated_seconds / 60.0), 2) if simulated_seconds > 0 else 0.0,
+        "max_admitted_per_clock_minute": max(full_minutes) if full_minutes else admitted,
+        "upstream_calls": upstream_calls,
+        "evals": evals,
+        "waits_rpm": waits_rpm,
+        "waits_tokens": waits_tokens,
+        "timed_out_over_300s": timed_out,
+        "left_in_queue": len(queue),
+        "worst_60s_window": {
+            "upstream_calls": worst_rpm,
+            "upstream_calls_at_offset_s": round(worst_rpm_at - SIM_START_TS, 3),
+            "tokens": worst_tpm,
+            "tokens_at_offset_s": round(worst_tpm_at - SIM_START_TS, 3),
+        },
+        "queue_delay": delays.to_dict(),
+    }
+
+def apply_overrides(args: argparse.Namespace):
+    """CLI 인자로 config 값을 덮어씁니다. admission_script_args()가 매 호출 시 config를 읽습니다."""
+    if args.rpm_limit is not None:
+        config.RPM_LIMIT = args.rpm_limit
+    if args.tpm_limit is not None:
+        config.TPM_LIMIT = args.tpm_limit
+    if args.burst_factor is not None:
+        config.BURST_FACTOR = args.burst_factor
+    if args.strict_rpm is not None:
+        config.ENFORCE_STRICT_RPM = args.strict_rpm == "on"
+    if args.micro_batch is not None:
+        config.MICRO_BATCH_ENABLED = args.micro_batch == "on"
+    if args.micro_batch_max_size is not None:
+        config.MICRO_BATCH_MAX_SIZE = args.micro_batch_max_size
+    if args.micro_batch_linger_seconds is not None:
+        config.MICRO_BATCH_MAX_LINGER_SECONDS = args.micro_batch_linger_seconds
+
+def main():
+    parser = argparse.ArgumentParser(description="Virtual-clock simulator for the APIM admission algorithm")
+    parser.add_argument("--rpm", type=float, default=float(config.RPM_LIMIT), help="평균 도착률 (requests/min)")
+    parser.add_argument("--hours", type=float, default=24.0, help="시뮬레이션할 트래픽 시간")
+    parser.add_argument("--pattern", choices=("poisson", "constant", "bursty"), default="poisson")
+    parser.add_argument("--burst-period", type=float, default=300.0, help="bursty: on-off 주기(초)")
+    parser.add_argument("--burst-duty", type=float, default=0.2, help="bursty: 주기 중 요청이 몰리는 비율")
+    parser.add_argument("--trace", help="trace 재생용 jsonl 파일 (benchmarks.loadgen 형식)")
+    parser.add_argument("--time-scale", type=float, default=1.0)
+    parser.add_argument("--tokens-per-request", type=int, default=DEFAULT_TOKENS_PER_REQUEST)
+    parser.add_argument("--service-seconds", type=float, default=DEFAULT_SERVICE_SECONDS)
+    parser.add_argument("--eval-seconds", type=float, default=DEFAULT_EVAL_SECONDS)
+    parser.add_argument("--rpm-limit", type=float, help="config.RPM_LIMIT 덮어쓰기")
+    parser.add_argument("--tpm-limit", type=float, help="config.TPM_LIMIT 덮어쓰기")
+    parser.add_argument("--burst-factor", type=float, help="config.BURST_FACTOR 덮어쓰기")
+    parser.add_argument("--strict-rpm", choices=("on", "off"), help="config.ENFORCE_STRICT_RPM 덮어쓰기")
+    parser.add_argument("--micro-batch", choices=("on", "off"), help="config.MICRO_BATCH_ENABLED 덮어쓰기")
+    parser.add_argument("--micro-batch-max-size", type=int, help="config.MICRO_BATCH_MAX_SIZE 덮어쓰기")
+    parser.add_argument("--micro-batch-linger-seconds", type=float, help="config.MICRO_BATCH_MAX_LINGER_SECONDS 덮어쓰기")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--differential", action="store_true", help="로컬 Redis의 실제 LUA_SCHEDULE과 결과 비교")
+    parser.add_argument("--differential-calls", type=int, default=20000, help="Redis와 비교할 최대 admission 호출 수")
+    parser.add_argument("--redis-db", type=int, default=config.APIM_REDIS_DB)
+    parser.add_argument("--report", help="JSON 리포트 출력 경로")
+    args = parser.parse_args()
+    apply_overrides(args)
+
+    model = AdmissionModel()
+    admit = model.admit
+    differential: Optional[DifferentialAdmission] = None
+    if args.differential:
+        import redis
+        redis_client = redis.Redis(host=config.REDIS_HOST, port=config.REDIS_PORT, db=args.redis_db)
+        redis_client.delete(f"{SIM_KEY_PREFIX}:rpm_capacity", f"{SIM_KEY_PREFIX}:tpm_capacity", f"{SIM_KEY_PREFIX}:rpm_window")
+        differential = DifferentialAdmission(model, redis_client, args.differential_calls)
+        admit = differential.admit
+
+    started = time.perf_counter()
+    result = simulate(generate_arrivals(args, random.Random(args.seed)), admit, args.service_seconds, args.eval_seconds)
+    wall_seconds = time.perf_counter() - started
+
+    report = {
+        "params": {k: v for k, v in vars(args).items() if k != "report"},
+        "limits": {
+            "rpm_limit": config.RPM_LIMIT,
+            "tpm_limit": config.TPM_LIMIT,
+            "burst_factor": config.BURST_FACTOR,
+            "enforce_strict_rpm": config.ENFORCE_STRICT_RPM,
+            "micro_batch_enabled": config.MICRO_BATCH_ENABLED,
+            "micro_batch_max_size": config.MICRO_BATCH_MAX_SIZE,
+            "micro_batch_max_linger_seconds": config.MICRO_BATCH_MAX_LINGER_SECONDS,
+            "micro_batch_max_input_tokens": config.MICRO_BATCH_MAX_INPUT_TOKENS,
+        },
+        "wall_seconds": round(wall_seconds, 3),
+        **result,
+    }
+    if differential:
+        report["differential"] = {"calls": differential.calls, "mismatches": len(differential.mismatches), "first_mismatches": differential.mismatches[:10]}
+        redis_client.delete(f"{SIM_KEY_PREFIX}:rpm_capacity", f"{SIM_KEY_PREFIX}:tpm_capacity", f"{SIM_KEY_PREFIX}:rpm_window")
+
+    worst = result["worst_60s_window"]
+    delay = result["queue_delay"]
+    logging.info(f"Simulated {result['simulated_seconds'] / 3600:.2f}h in {wall_seconds:.1f}s wall "
+                 f"(RPM_LIMIT={config.RPM_LIMIT}, TPM_LIMIT={config.TPM_LIMIT}, BURST_FACTOR={config.BURST_FACTOR}, STRICT={config.ENFORCE_STRICT_RPM}, "
+                 f"MICRO_BATCH={config.MICRO_BATCH_ENABLED})")
+    logging.info(f"Admitted: {result['admitted']} ({result['admitted_rpm']} RPM avg, max {result['max_admitted_per_clock_minute']}/clock-minute), "
+                 f"upstream calls: {result['upstream_calls']}, left in queue: {result['left_in_queue']}, >300s: {result['timed_out_over_300s']}")
+    logging.info(f"Worst 60s window: {worst['upstream_calls']} upstream calls / {config.RPM_LIMIT:g}, {worst['tokens']} tokens / {config.TPM_LIMIT:g}")
+    pcts = " ".join(f"{k}={v:.1f}" for k, v in delay["percentiles_ms"].items())
+    logging.info(f"Queue delay (ms): mean={delay['mean_ms']:.1f} {pcts} max={delay['max_ms']:.1f}")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        logging.info(f"Report written to {args.report}")
+
+    if differential:
+        if differential.mismatches:
+            for m in differential.mismatches[:10]:
+                logging.error(f"MISMATCH: {m}")
+            logging.error(f"{len(differential.mismatches)}/{differential.calls} admission calls differ from Redis LUA_SCHEDULE")
+            sys.exit(1)
+        logging.info(f"Differential check passed: {differential.calls} admission calls match Redis LUA_SCHEDULE")
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,20 @@ BURST_FACTOR: float = 0.8
 # True로 두면 rpm_window의 ZCOUNT로 60초 내 요청 수를 보고 한도를 넘기지 않게 스케줄링합니다.
 ENFORCE_STRICT_RPM: bool = True
 
+# --- 요청/응답 본문 처리 방식 ---
+# True  = 원본 바이트 그대로 전달 (재직렬화 없음, 토큰 집계용 json.loads 파싱만)
+#         업스트림의 status/헤더도 그대로 반환하며, JSON이 아닌 요청 본문도 거절하지 않고 업스트림으로 전달합니다.
+# False = 기존 방식 (request.json() -> json= 재인코딩 -> response.json() -> JSONResponse 재직렬화)
+PASSTHROUGH_MODE: bool = False
+
+# --- Micro-batching: 짧은 프롬프트 여러 개를 배치 엔드포인트(APIM_BATCH_URL) 호출 1회로 묶어 RPM 1 단위로 전송 ---
+# RPM이 병목이고 TPM 여유가 클 때 유리합니다. (streaming 요청은 항상 단건 전송)
+# 배치 응답을 요청별로 분리해 재직렬화하므로, 활성화하면 PASSTHROUGH_MODE는 무시되고 JSON 경로로 처리됩니다.
+MICRO_BATCH_ENABLED: bool = False
+MICRO_BATCH_MAX_SIZE: int = 8                  # 배치 1회에 묶을 최대 요청 수
+MICRO_BATCH_MAX_LINGER_SECONDS: float = 0.005  # 첫 요청 이후 추가 요청을 기다리는 최대 시간
+MICRO_BATCH_MAX_INPUT_TOKENS: int = 500        # 이 값 이하의 입력 토큰(글자 수) 요청만 배치 대상
+
 # --- Redis 연결 정보 ---
 REDIS_HOST: str = "localhost"
 REDIS_PORT: int = 6379
@@ -25,6 +39,7 @@ APIM_REDIS_DB: int = 1  # APIM 서버와 다른 DB를 사용하여 상태를 격
 # --- 호출할 대상 서버 정보 ---
 # 이 브로커가 최종적으로 요청을 보낼 LLM APIM 서버의 주소입니다.
 APIM_URL = "http://127.0.0.1:8000/v1/chat/completions" # 이 부분을 확인 및 수정해주세요.
+APIM_BATCH_URL = "http://127.0.0.1:8000/v1/chat/completions/batch" # MICRO_BATCH_ENABLED일 때 사용하는 배치 엔드포인트
 LLM_APIM_API_KEY: str = "DUMMY_API_KEY" # APIM 서버가 키를 요구할 경우 사용
 
 LLM_RATE_LIMIT_PREFIX: str = "llm_usage"
@@ -1,7 +1,7 @@
 from fastapi import APIRouter
 from fastapi.responses import StreamingResponse
 
-from llm_mock_server.app.models.chat import ChatCompletionRequest
+from llm_mock_server.app.models.chat import ChatCompletionBatchRequest, ChatCompletionRequest
 from llm_mock_server.app.services import chat_service
 
 router = APIRouter()
@@ -15,4 +15,9 @@ async def chat_completions(request: ChatCompletionRequest):
             media_type="text/event-stream"
         )
     else:
-        return await chat_service.create_non_streaming_response(request.model)
\ No newline at end of file
+        return await chat_service.create_non_streaming_response(request.model)
+
+@router.post("/completions/batch")
+async def chat_completions_batch(request: ChatCompletionBatchRequest):
+    """LLM Mock Batch Endpoint (항목별 검증)"""
+    return await chat_service.create_batch_response(request.requests)
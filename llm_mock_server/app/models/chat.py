@@ -1,6 +1,6 @@
 import time
 import uuid
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Union
 
 from pydantic import BaseModel, Field
 
@@ -33,6 +33,19 @@ class ChatCompletionResponse(BaseModel):
     choices: List[ChatCompletionResponseChoice]
     usage: Usage
 
+# Batch 요청/응답 모델 (요청 순서대로 응답, streaming 미지원)
+# 요청은 항목별로 검증하며, 잘못된 항목은 배치 전체가 아닌 해당 위치의 ChatCompletionBatchError로 응답합니다.
+class ChatCompletionBatchRequest(BaseModel):
+    requests: List[Any]
+
+class ChatCompletionBatchError(BaseModel):
+    status_code: int = 422
+    detail: List[Dict[str, Any]]  # 단건 요청의 422 응답과 같은 형식
+
+class ChatCompletionBatchResponse(BaseModel):
+    object: str = "batch"
+    responses: List[Union[ChatCompletionResponse, ChatCompletionBatchError]]
+
 # Streaming 응답 모델
 class DeltaMessage(BaseModel):
     role: Optional[str] = None
@@ -2,9 +2,15 @@ import asyncio
 import time
 import uuid
 from datetime import datetime
-from typing import AsyncGenerator
+from typing import Any, AsyncGenerator, List, Union
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import ValidationError
 
 from llm_mock_server.app.models.chat import (
+    ChatCompletionBatchError,
+    ChatCompletionBatchResponse,
+    ChatCompletionRequest,
     ChatMessage,
     ChatCompletionResponse,
     ChatCompletionResponseChoice,
@@ -50,10 +56,8 @@ async def stream_generator(model: str) -> AsyncGenerator[str, None]:
     yield yield_data
     yield "data: [DONE]\n\n"
 
-async def create_non_streaming_response(model: str) -> ChatCompletionResponse:
-    """Non-Streaming 응답 생성 로직"""
-    await asyncio.sleep(0.01)
-    response = ChatCompletionResponse(
+def _build_response(model: str) -> ChatCompletionResponse:
+    return ChatCompletionResponse(
         model=model,
         choices=[
             ChatCompletionResponseChoice(
@@ -62,5 +66,26 @@ async def create_non_streaming_response(model: str) -> ChatCompletionResponse:
         ],
         usage=Usage(),
     )
+
+async def create_non_streaming_response(model: str) -> ChatCompletionResponse:
+    """Non-Streaming 응답 생성 로직"""
+    await asyncio.sleep(0.01)
+    response = _build_response(model)
     logger.info(f"{response.model_dump_json(exclude_unset=True, indent=2)}")
-    return response
\ No newline at end of file
+    return response
+
+def _build_batch_item(raw_request: Any) -> Union[ChatCompletionResponse, ChatCompletionBatchError]:
+    try:
+        request = ChatCompletionRequest.model_validate(raw_request)
+    except ValidationError as e:
+        errors = [{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)]
+        return ChatCompletionBatchError(detail=jsonable_encoder(errors))
+    return _build_response(request.model)
+
+async def create_batch_response(requests: List[Any]) -> ChatCompletionBatchResponse:
+    """Batch 응답 생성 로직 (단건과 같은 지연 1회로 요청 순서대로 응답, 잘못된 항목은 해당 위치에만 오류 반환)"""
+    await asyncio.sleep(0.01)
+    response = ChatCompletionBatchResponse(responses=[_build_batch_item(raw_request) for raw_request in requests])
+    errors = sum(isinstance(item, ChatCompletionBatchError) for item in response.responses)
+    logger.info(f"batch of {len(response.responses)} responses ({errors} invalid)")
+    return response
@@ -0,0 +1,10 @@
+from benchmarks.loadgen import LatencyHistogram
+
+def test_relative_error_bound_holds_across_octaves():
+    for bits in (3, 7):
+        for value_us in [v for k in range(1, 31) for v in (2 ** k - 1, 2 ** k, 2 ** k + 1, 3 * 2 ** (k - 1))]:
+            histogram = LatencyHistogram(bits)
+            histogram.record(value_us / 1_000_000)
+            histogram.record(1e6)  # max_us가 상한을 잘라내지 않도록 큰 값을 함께 기록
+            reported = histogram.value_at_percentile(50)
+            assert value_us <= reported <= value_us * (1 + 1 / 2 ** bits)
@@ -0,0 +1,45 @@
+import asyncio
+
+import config
+from apim_server import apim_server
+from apim_server.apim_server import collect_batch, request_input_tokens, split_batch_response
+
+def _item(name, content="hi", stream=False):
+    payload = {"messages": [{"role": "user", "content": content}]}
+    if stream: payload["stream"] = True
+    return (name, payload, None, 0.0)
+
+def _collect(monkeypatch, items, max_size=8):
+    monkeypatch.setattr(config, "MICRO_BATCH_MAX_SIZE", max_size)
+    monkeypatch.setattr(config, "MICRO_BATCH_MAX_LINGER_SECONDS", 0.0)
+    monkeypatch.setattr(config, "MICRO_BATCH_MAX_INPUT_TOKENS", 10)
+
+    async def run():
+        queue = apim_server.RequestQueue()
+        monkeypatch.setattr(apim_server, "REQUEST_QUEUE", queue)
+        for item in items[1:]:
+            queue.put_nowait(item)
+        batch = await collect_batch((items[0], request_input_tokens(items[0][1])))
+        remaining = [queue.get_nowait()[0] for _ in range(queue.qsize())]
+        return [item[0] for item, _ in batch], remaining
+
+    return asyncio.run(run())
+
+def test_collect_batch_stops_at_first_non_batchable_request(monkeypatch):
+    items = [_item("a"), _item("b"), _item("long", content="x" * 11), _item("c"), _item("stream", stream=True)]
+    batch, remaining = _collect(monkeypatch, items)
+    assert batch == ["a", "b"]
+    assert remaining == ["long", "c", "stream"]
+
+def test_collect_batch_respects_max_size(monkeypatch):
+    batch, remaining = _collect(monkeypatch, [_item(name) for name in "abcde"], max_size=3)
+    assert batch == ["a", "b", "c"]
+    assert remaining == ["d", "e"]
+
+def test_split_batch_response_maps_item_errors_to_their_caller():
+    ok = {"choices": [{"message": {"role": "assistant", "content": "done"}}]}
+    error = {"status_code": 422, "detail": [{"type": "missing", "loc": ["body", "messages", 0, "content"]}]}
+    results, output_tokens = split_batch_response({"responses": [ok, error, ok]}, 3)
+    assert [status for _, status, _ in results] == [200, 422, 200]
+    assert results[1][0] == {"detail": error["detail"]}
+    assert output_tokens == 2 * len("done")
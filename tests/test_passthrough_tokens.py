@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from apim_server.apim_server import (
+    count_body_input_tokens,
+    count_body_output_tokens,
+    count_input_tokens,
+    count_output_tokens,
+)
+
+REQUESTS = [
+    {"messages": [{"role": "user", "content": "x"}], "metadata": {"content": "extra stuff"}},
+    {"messages": [{"role": "user", "content": 'quote \\" and "content": "x" 안녕\n😀\\'}]},
+    {"messages": [{"role": "system", "content": ""}, {"role": "user", "content": "a" * 5000}]},
+    {"model": "gpt-4o", "stream": False, "messages": [{"role": "content", "name": {"content": "nested"}, "content": "ok"}]},
+    {"messages": [{"role": "user", "content": "[{,:}]"}], "extra": [{"messages": [{"content": "inner"}]}]},
+    {"tools": {"messages": [{"content": "not top-level"}]}},
+    {"messages": []},
+    {},
+]
+
+RESPONSES = [
+    {"choices": [{"index": 0, "message": {"role": "assistant", "content": "positive\n"}}]},
+    {"choices": [{"message": {"content": "é 😀 \\u0041"}}, {"message": {"content": "two"}}], "usage": {"content": "x"}},
+    {"id": "x", "choices": [{"delta": {"content": "ignored"}, "message": {"content": "kept", "tool": {"content": "no"}}}]},
+    {"content": "top-level", "choices": []},
+    {},
+]
+
+def _encodings(obj):
+    yield json.dumps(obj).encode("utf-8")
+    yield json.dumps(obj, ensure_ascii=False).encode("utf-8")
+    yield json.dumps(obj, separators=(",", ":")).encode("utf-8")
+    yield json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+
+@pytest.mark.parametrize("payload", REQUESTS)
+def test_body_input_tokens_match_count_input_tokens(payload):
+    for body in _encodings(payload):
+        assert count_body_input_tokens(body) == count_input_tokens(payload)
+
+@pytest.mark.parametrize("response_json", RESPONSES)
+def test_body_output_tokens_match_count_output_tokens(response_json):
+    for body in _encodings(response_json):
+        assert count_body_output_tokens(body) == count_output_tokens(response_json)
+
+def test_large_many_message_body():
+    payload = {"messages": [{"role": "user", "content": f'item {i} said "hi" \\ 안녕'} for i in range(3000)]}
+    body = json.dumps(payload).encode("utf-8")
+    assert count_body_input_tokens(body) == count_input_tokens(payload)
+
+def test_malformed_body_counts_zero():
+    for body in (b'{"messages":[{"content":"abc', b"not json", b"\xff\xfe"):
+        assert count_body_input_tokens(body) == 0
+        assert count_body_output_tokens(body) == 0